@@ -0,0 +1,55 @@
+import numpy as np
+import numba
+
+
+def _native(array):
+    # numba only handles native byte order, while FITS columns are big-endian
+    array = np.asarray(array)
+    return array.astype(array.dtype.newbyteorder('='), copy=False)
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def _sky_to_cartesian(dist, ra, dec, out):
+    for i in numba.prange(dist.size):
+        cosdec = np.cos(dec[i])
+        out[i, 0] = dist[i] * cosdec * np.cos(ra[i])
+        out[i, 1] = dist[i] * cosdec * np.sin(ra[i])
+        out[i, 2] = dist[i] * np.sin(dec[i])
+
+
+def sky_to_cartesian(dist, ra, dec, dtype='f4', out=None):
+    """Convert distance and RA, Dec (in radians) to (N, 3) cartesian positions, in a single pass."""
+    if out is None:
+        out = np.empty((len(dist), 3), dtype=dtype)
+    _sky_to_cartesian(_native(dist), _native(ra), _native(dec), out)
+    return out
+
+
+def tabulate_distance(distance, zmax=3., nz=4096):
+    """Tabulate distance(z) on a regular redshift grid, for :func:`cartesian_to_sky`."""
+    zgrid = np.linspace(0., zmax, nz)
+    return zgrid, np.asarray(distance(zgrid), dtype='f8')
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def _cartesian_to_sky(positions, zgrid, dgrid, ra, dec, z):
+    nz = dgrid.size
+    for i in numba.prange(positions.shape[0]):
+        x, y, w = float(positions[i, 0]), float(positions[i, 1]), float(positions[i, 2])
+        dist = np.sqrt(x * x + y * y + w * w)
+        ra[i] = np.rad2deg(np.arctan2(y, x)) % 360.
+        dec[i] = np.rad2deg(np.arcsin(w / dist))
+        j = min(max(np.searchsorted(dgrid, dist), 1), nz - 1)
+        t = (dist - dgrid[j - 1]) / (dgrid[j] - dgrid[j - 1])
+        z[i] = zgrid[j - 1] + t * (zgrid[j] - zgrid[j - 1])
+
+
+def cartesian_to_sky(positions, distance_table):
+    """
+    Convert (N, 3) cartesian positions to RA, Dec (in degrees) and redshift, in a single pass.
+    Redshifts are linearly interpolated in ``distance_table``, as returned by :func:`tabulate_distance`.
+    """
+    ra, dec, z = (np.empty(len(positions), dtype='f8') for i in range(3))
+    zgrid, dgrid = distance_table
+    _cartesian_to_sky(_native(positions), zgrid, dgrid, ra, dec, z)
+    return ra, dec, z
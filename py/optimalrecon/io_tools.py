@@ -1,7 +1,9 @@
 import os
 import logging
+import functools
 import numpy as np
-from astropy.table import Table, vstack
+import fitsio
+from astropy.table import Table
 
 
 logger = logging.getLogger('io_tools')
@@ -37,22 +39,25 @@ def catalog_dir(tracer, mock_type='cutsky', phase_idx=0, cosmo_idx=0,
     return os.path.join(base_dir, 'CutSky', tracer, f'z{redshift:.3f}')
 
 
+@functools.lru_cache(maxsize=None)
 def catalog_fn(tracer='LRG', mock_type='cutsky', cat_dir=None, phase=0,
-    name='data', nrandoms=4, rec_type=None, region=None, **kwargs):
+    name='data', nrandoms=4, rec_type=None, region=None, compress=False, **kwargs):
     if cat_dir is None:
         cat_dir = catalog_dir(tracer=tracer, mock_type=mock_type, **kwargs)
     redshift = get_z_cubicbox(tracer)
 
     if mock_type == 'cutsky':
         if rec_type:
+            # reconstructed catalogs may be written gzip-compressed
+            ext = '.fits.gz' if compress else '.fits'
             if name == 'data':
-                return os.path.join(cat_dir, f'cutsky_{tracer}_{region}_z{redshift:.3f}_AbacusSummit_base_c000_ph{phase:03}_{rec_type}.fits')
-            return [os.path.join(cat_dir, f'cutsky_{tracer}_{region}_random_S{i*100}_1X_{rec_type}.fits') for i in range(1, nrandoms + 1)]
+                return os.path.join(cat_dir, f'cutsky_{tracer}_{region}_z{redshift:.3f}_AbacusSummit_base_c000_ph{phase:03}_{rec_type}{ext}')
+            return tuple(os.path.join(cat_dir, f'cutsky_{tracer}_{region}_random_S{i*100}_1X_{rec_type}{ext}') for i in range(1, nrandoms + 1))
         if name == 'data':
             return os.path.join(cat_dir, f'cutsky_{tracer}_z{redshift:.3f}_AbacusSummit_base_c000_ph{phase:03}.fits')
         if tracer.startswith('BGS'):
-            return [os.path.join(cat_dir, f'random_S{i*100}_1X.fits') for i in range(1, nrandoms + 1)]
-        return [os.path.join(cat_dir, f'cutsky_{tracer}_random_S{i*100}_1X.fits') for i in range(1, nrandoms + 1)]
+            return tuple(os.path.join(cat_dir, f'random_S{i*100}_1X.fits') for i in range(1, nrandoms + 1))
+        return tuple(os.path.join(cat_dir, f'cutsky_{tracer}_random_S{i*100}_1X.fits') for i in range(1, nrandoms + 1))
     else:
         raise NotImplementedError(f'catalog_fn not implemented for mock_type={mock_type}')
 
@@ -79,13 +84,22 @@ def read_positions_weights_cubicbox(filename, boxsize, hubble, az, los='z'):
     elif los == 'z':
         return x, y, z_rsd, weights
 
+def get_cutsky_columns(weight_type='FKP'):
+    """Columns of a cutsky catalog used for selection and weighting."""
+    columns = ['RA', 'DEC', 'Z', 'STATUS']
+    if 'FKP' in weight_type:
+        columns += ['NZ']
+    return columns
+
 def read_positions_weights_cutsky(filename, zlim=None, region='NGC', abs_maglim=None, app_maglim=None,
-    weight_type='FKP', return_mask=False):
+    weight_type='FKP', return_mask=False, radians=False):
     if not isinstance(filename, (tuple, list)):
         filename = [filename]
     positions, weights, mask = [], [], []
     for fn in filename:
-        data = Table.read(fn)
+        columns = get_cutsky_columns(weight_type='' if 'BGS' in fn else weight_type)
+        with fitsio.FITS(fn) as f:
+            data = f[1].read(columns=columns)
         if 'LRG' in fn:
             mask_bits = get_desi_mask(main=1, Y5=1)
         else:
@@ -107,6 +121,8 @@ def read_positions_weights_cutsky(filename, zlim=None, region='NGC', abs_maglim=
         weights.append(_weights)
         mask.append(_mask)
     positions = np.concatenate(positions, axis=1)
+    if radians:
+        np.deg2rad(positions[:2], out=positions[:2])
     weights = np.concatenate(weights)
     mask = np.concatenate(mask)
     if return_mask:
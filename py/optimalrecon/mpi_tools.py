@@ -0,0 +1,76 @@
+import logging
+import numpy as np
+
+
+class RootLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter emitting records on rank ``mpiroot`` of ``mpicomm`` only; messages are not even formatted on other ranks."""
+
+    def __init__(self, logger, mpicomm=None, mpiroot=0):
+        super().__init__(logger, {})
+        self.isroot = mpicomm is None or mpicomm.rank == mpiroot
+
+    def isEnabledFor(self, level):
+        return self.isroot and self.logger.isEnabledFor(level)
+
+
+def bcast(obj, mpicomm=None, mpiroot=0):
+    """Broadcast ``obj`` from rank ``mpiroot``; without ``mpicomm``, return ``obj``."""
+    if mpicomm is None:
+        return obj
+    return mpicomm.bcast(obj, root=mpiroot)
+
+
+def get_node_size(mpicomm=None):
+    """Return the number of ranks of ``mpicomm`` sharing the node of the calling rank (collective); 1 without ``mpicomm``."""
+    if mpicomm is None:
+        return 1
+    from mpi4py import MPI
+    nodecomm = mpicomm.Split_type(MPI.COMM_TYPE_SHARED)
+    toret = nodecomm.size
+    nodecomm.Free()
+    return toret
+
+
+def _get_counts(size, mpicomm):
+    bounds = np.array([rank * size // mpicomm.size for rank in range(mpicomm.size + 1)])
+    return np.diff(bounds), bounds[:-1]
+
+
+def scatter_array(array, mpicomm=None, mpiroot=0):
+    """
+    Start scattering (C-contiguous) ``array``, held by rank ``mpiroot``, along its first axis.
+    Return the local chunk, to be read only once the returned request is completed (see :func:`wait_all`).
+    Without ``mpicomm``, return ``array`` and ``None``.
+    """
+    if mpicomm is None:
+        return array, None
+    ismpiroot = mpicomm.rank == mpiroot
+    shape, dtype = mpicomm.bcast((array.shape, array.dtype) if ismpiroot else None, root=mpiroot)
+    counts, displs = _get_counts(shape[0], mpicomm)
+    csize = int(np.prod(shape[1:], dtype='i8'))
+    local = np.empty((counts[mpicomm.rank],) + tuple(shape[1:]), dtype=dtype)
+    sendbuf = [array, (counts * csize, displs * csize)] if ismpiroot else None
+    return local, mpicomm.Iscatterv(sendbuf, local, root=mpiroot)
+
+
+def gather_array(array, mpicomm=None, mpiroot=0):
+    """Gather ``array`` along its first axis on rank ``mpiroot``; other ranks get ``None``."""
+    if mpicomm is None:
+        return array
+    array = np.ascontiguousarray(array)
+    counts = mpicomm.gather(len(array), root=mpiroot)
+    toret, recvbuf = None, None
+    if mpicomm.rank == mpiroot:
+        counts = np.array(counts)
+        csize = int(np.prod(array.shape[1:], dtype='i8'))
+        toret = np.empty((counts.sum(),) + array.shape[1:], dtype=array.dtype)
+        recvbuf = [toret, (counts * csize, (np.cumsum(counts) - counts) * csize)]
+    mpicomm.Gatherv(array, recvbuf, root=mpiroot)
+    return toret
+
+
+def wait_all(requests):
+    """Wait for the requests returned by :func:`scatter_array`."""
+    for request in requests:
+        if request is not None:
+            request.Wait()
@@ -1,7 +1,14 @@
-from cosmoprimo.fiducial import DESI
+import os
+import pickle
+import logging
+import numpy as np
+
+
+logger = logging.getLogger('recon_tools')
 
 
 def get_f_reconstruction(zbox, zlim=None, mock_type='cutsky'):
+    from cosmoprimo.fiducial import DESI
     cosmo = DESI()
     H_0 = 100.0
     f_cubic = cosmo.sigma8_z(z=zbox, of='theta_cb') / cosmo.sigma8_z(z=zbox, of='delta_cb')
@@ -12,4 +19,50 @@ def get_f_reconstruction(zbox, zlim=None, mock_type='cutsky'):
     zmid = (zmax + zmin) / 2
     H_cutsky = H_0 * cosmo.efunc(zmid)
     a_cutsky = 1 / (1 + zmid)
-    return (a_cubic * H_cubic) / (a_cutsky * H_cutsky) * f_cubic
\ No newline at end of file
+    return (a_cubic * H_cubic) / (a_cutsky * H_cutsky) * f_cubic
+
+
+def get_fft_nmesh(nmesh):
+    """Smallest even mesh size >= nmesh with only 2, 3 and 5 as prime factors, for which FFTs are efficient."""
+    nmesh = max(int(np.ceil(nmesh)), 2)
+    nmesh += nmesh % 2
+    while True:
+        remainder = nmesh
+        for factor in [2, 3, 5]:
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return nmesh
+        nmesh += 2
+
+
+def load_fftw_wisdom(filename):
+    """Load FFTW wisdom saved with :func:`save_fftw_wisdom`, if any; an unreadable file is ignored."""
+    import pyfftw
+    if os.path.isfile(filename):
+        try:
+            with open(filename, 'rb') as file:
+                wisdom = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError) as exc:
+            logger.warning('Ignoring unreadable FFTW wisdom {}: {}.'.format(filename, exc))
+            return
+        pyfftw.import_wisdom(wisdom)
+
+
+def save_fftw_wisdom(filename):
+    """
+    Save FFTW wisdom to filename, atomically so that concurrent jobs never see a partial file.
+    Wisdom is only a cache: a failed write is logged and ignored.
+    """
+    import pyfftw
+    tmp_filename = '{}.{:d}.tmp'.format(filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as file:
+            pickle.dump(pyfftw.export_wisdom(), file)
+        os.replace(tmp_filename, filename)
+    except OSError as exc:
+        logger.warning('Could not save FFTW wisdom {}: {}.'.format(filename, exc))
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
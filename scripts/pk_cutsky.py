@@ -106,17 +106,11 @@ def run_pk(distance, data_fn, randoms_fn, data_rec_fn, randoms_rec_fn,
 
         
         
+_BIAS = {'ELG': 1.2, 'QSO': 2.07, 'LRG': 1.99, 'BGS': 1.5}
+
 def get_bias(tracer='ELG'):
     """Get the default tracer bias for a given target sample."""
-    if tracer.startswith('ELG'):
-        return 1.2
-    if tracer.startswith('QSO'):
-        return 2.07
-    if tracer.startswith('LRG'):
-        return 1.99
-    if tracer.startswith('BGS'):
-        return 1.5
-    return 1.2
+    return next((bias for prefix, bias in _BIAS.items() if tracer.startswith(prefix)), 1.2)
 
 
 
@@ -140,6 +134,7 @@ if __name__ == '__main__':
     parser.add_argument('--cellsize', help='cell size', type=float, default=7)
     parser.add_argument('--abs_maglim', help='absolute magnitude limit', type=float, default=None)
     parser.add_argument('--app_maglim', help='apparent magnitude limit', type=float, default=None)
+    parser.add_argument('--compress', help='read reconstructed catalogs written with recon_cutsky.py --compress (.fits.gz)', action='store_true')
 
     args = parser.parse_args()
 
@@ -180,9 +175,9 @@ if __name__ == '__main__':
             data_rec_fn, randoms_rec_fn, pk_rec_fn = None, None, None
             if args.algorithm is not None: 
                 data_rec_fn = catalog_fn(tracer=args.tracer, cat_dir=args.recon_dir, rec_type=args.algorithm+args.convention,
-                                        name='data', region=region, nrandoms=args.nran, mock_type='cutsky')
+                                        name='data', region=region, nrandoms=args.nran, mock_type='cutsky', compress=args.compress)
                 randoms_rec_fn = catalog_fn(tracer=args.tracer, cat_dir=args.recon_dir, rec_type=args.algorithm+args.convention,
-                                            name='randoms', region=region, nrandoms=args.nran, mock_type='cutsky')
+                                            name='randoms', region=region, nrandoms=args.nran, mock_type='cutsky', compress=args.compress)
                 pk_rec_fn = os.path.join(args.outdir, f'Pk_cutsky_{args.tracer}_{region}_{args.algorithm+args.convention}.npy')
             pk_fn = os.path.join(args.outdir, f'Pk_cutsky_{args.tracer}_{region}.npy')
             run_pk(distance, data_fn, randoms_fn, data_rec_fn=data_rec_fn, randoms_rec_fn=randoms_rec_fn,
@@ -1,105 +1,220 @@
 import numpy as np
-from astropy.table import Table
+import fitsio
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from optimalrecon.io_tools import catalog_fn, get_z_cutsky, get_z_cubicbox
-from optimalrecon.io_tools import read_positions_weights_cutsky
-from optimalrecon.recon_tools import get_f_reconstruction
+from optimalrecon.io_tools import read_positions_weights_cutsky, get_cutsky_columns
+from optimalrecon.recon_tools import get_f_reconstruction, get_fft_nmesh, load_fftw_wisdom, save_fftw_wisdom
+from optimalrecon.coord_tools import sky_to_cartesian, cartesian_to_sky, tabulate_distance
+from optimalrecon.mpi_tools import bcast, scatter_array, gather_array, wait_all, get_node_size, RootLoggerAdapter
 from pyrecon import mpi, utils, setup_logging
 from pyrecon import MultiGridReconstruction, IterativeFFTReconstruction, IterativeFFTParticleReconstruction
-from cosmoprimo.fiducial import DESI
+from scipy.interpolate import CubicSpline
 import argparse
-import matplotlib.pyplot as plt
 
 logger = logging.getLogger('recon')
 
-def run_reconstruction(Reconstruction, distance, data_fn, randoms_fn,
+def get_catalog_dtype(fn):
+    """
+    Return the dtype of the output catalog built by :func:`read_catalog` from cutsky catalog fn:
+    RA, DEC, Z (float64), then the columns propagated to the reconstructed catalog.
+    These are the columns needed downstream (e.g. NZ for FKP weights), whatever the weights used for reconstruction.
+    """
+    positions = ['RA', 'DEC', 'Z']
+    with fitsio.FITS(fn, 'r') as f:
+        hdu = f[1]
+        columns = [col for col in get_cutsky_columns(weight_type='FKP') if col in hdu.get_colnames() and col not in positions]
+        dtype = hdu.get_rec_dtype(columns=columns)[0]
+    return np.dtype([(col, 'f8') for col in positions] + [(col, dtype[col]) for col in columns])
+
+def read_catalog(fn, mask):
+    """
+    Return the output catalog for the rows of cutsky catalog fn selected by mask: columns propagated to the
+    reconstructed catalog are read for these rows only, RA, DEC, Z are left to be filled.
+    """
+    idx = np.flatnonzero(mask)
+    catalog = np.empty(idx.size, dtype=get_catalog_dtype(fn))
+    columns = catalog.dtype.names[3:]
+    if idx.size == 0:
+        return catalog
+    with fitsio.FITS(fn, 'r') as f:
+        raw = f[1].read(columns=list(columns), rows=idx)
+    for col in columns: catalog[col] = raw[col]
+    return catalog
+
+def write_catalog(fn, catalog):
+    """Write catalog to fn; cfitsio gzip-compresses it if fn ends with .gz."""
+    utils.mkdir(os.path.dirname(fn))
+    fitsio.write(fn, catalog, clobber=True)
+
+def get_nrows(fn):
+    with fitsio.FITS(fn) as f:
+        return f[1].get_nrows()
+
+def read_positions_weights(fn, distance, dtype='f4', buffers=None, **kwargs):
+    """
+    Read cartesian positions, weights and selection mask of a cutsky catalog.
+    If provided, positions and weights are written in the first rows of ``buffers``,
+    (N, 3) and (N,) arrays with N at least the number of rows of the catalog.
+    """
+    (ra, dec, z), weights, mask = read_positions_weights_cutsky(fn, return_mask=True, radians=True, **kwargs)
+    dist = distance(z)
+    if buffers is None:
+        return sky_to_cartesian(dist, ra, dec, dtype=dtype), weights.astype(dtype), mask
+    positions, toret = buffers[0][:len(dist)], buffers[1][:len(dist)]
+    sky_to_cartesian(dist, ra, dec, out=positions)
+    toret[...] = weights
+    return positions, toret, mask
+
+def run_reconstruction(Reconstruction, distance, distance_table, data_fn, randoms_fn,
     data_rec_fn, randoms_rec_fn, f, bias, boxsize=None, nmesh=None,
     cellsize=4, smoothing_radius=15, nthreads=64, convention='reciso',
-    dtype='f8', mpicomm=None, **kwargs):
+    dtype='f4', cache_memory=None, wisdom_dir=None, mpicomm=None, **kwargs):
     
     root = mpicomm is None or mpicomm.rank == 0
+    rlog = RootLoggerAdapter(logger, mpicomm)
 
     if np.ndim(randoms_fn) == 0: randoms_fn = [randoms_fn]
     
-    data_positions, data_weights = None, None
-    randoms_positions, randoms_weights = None, None
+    data_positions, data_weights, extent = None, None, None
+    # with MPI, root positions and weights are only sent to the ranks: allocate two sets of buffers fitting the
+    # largest catalog once, used in turn so that a file can be read while the previous one is sent
+    nbuffers = 2
+    buffers = [None] * nbuffers
+    if root and mpicomm is not None:
+        nmax = max(get_nrows(fn) for fn in [data_fn] + list(randoms_fn))
+        buffers = [(np.empty((nmax, 3), dtype=dtype), np.empty(nmax, dtype=dtype)) for ibuffer in range(nbuffers)]
+
+    def get_positions_weights(fn, ibuffer=0):
+        return read_positions_weights(fn, distance, dtype=dtype, buffers=buffers[ibuffer], **kwargs)
 
     if root:
-        logger.info('Loading {}.'.format(data_fn))
-        data = Table.read(data_fn)
-        (ra, dec, z), data_weights, mask = read_positions_weights_cutsky(data_fn, return_mask=True, **kwargs)
-        data = data[mask]
-        dist = distance(z)
-        data_positions = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
+        rlog.info('Loading %s.', data_fn)
+        data_positions, data_weights, mask = get_positions_weights(data_fn)
+        data = read_catalog(data_fn, mask)
+        extent = (data_positions.min(axis=0), data_positions.max(axis=0))
+
+    # distribute the data over ranks while the reconstruction meshes are allocated
+    data_positions, request_positions = scatter_array(data_positions, mpicomm)
+    data_weights, request_weights = scatter_array(data_weights, mpicomm)
+    pos_min, pos_max = bcast(extent, mpicomm)
+    boxcenter = (pos_min + pos_max) / 2.
+    boxpad = 1.2
+    if boxsize is None and nmesh is None:
+        # pad the box up to an FFT-friendly mesh size, at the requested cell size
+        nmesh = get_fft_nmesh(boxpad * np.max(pos_max - pos_min) / cellsize)
+        boxsize = nmesh * cellsize
+    elif boxsize is None:
+        boxsize = boxpad * np.max(pos_max - pos_min)
+    elif nmesh is None:
+        nmesh = get_fft_nmesh(boxsize / cellsize)
 
+    wisdom_fn = None
     if mpicomm is not None:
-        rec_kwargs = {'mpicomm': mpicomm, 'mpiroot': 0}
+        rec_kwargs = {'mpicomm': mpicomm, 'mpiroot': None}
     else:
         rec_kwargs = {'fft_engine': 'fftw', 'nthreads': nthreads}
+        if wisdom_dir is not None:
+            wisdom_fn = os.path.join(wisdom_dir, f'fftw_wisdom_{nmesh}.pkl')
+            load_fftw_wisdom(wisdom_fn)
     recon = Reconstruction(
-        f=f, bias=bias, boxsize=boxsize, nmesh=nmesh,
-        cellsize=cellsize, los='local', positions=data_positions,
-        boxpad=1.2, dtype=dtype, **rec_kwargs
+        f=f, bias=bias, boxsize=boxsize, boxcenter=boxcenter, nmesh=nmesh,
+        los='local', dtype=dtype, **rec_kwargs
     )
-
+    wait_all([request_positions, request_weights])
     recon.assign_data(data_positions, data_weights)
-    for fn in randoms_fn:
+
+    # random positions are needed again to write the reconstructed catalogs: keep them (distributed over ranks);
+    # root also keeps the output catalogs within cache_memory bytes, else only the selection masks to read them again
+    keep_randoms = convention != 'rsd'
+    randoms_positions_by_fn, catalogs, masks = {}, {}, {}
+    if not keep_randoms:
+        cache_memory = 0
+    elif cache_memory is None:
+        # the meshes of set_density_contrast and run are allocated after all randoms are loaded, on all ranks of the node:
+        # cached catalogs may only take a fraction of the available memory of root's share of the node
+        max_cache_fraction = 0.25
+        nodesize = get_node_size(mpicomm)
         if root:
-            logger.info('Loading {}.'.format(fn))
-            (ra, dec, z), randoms_weights = read_positions_weights_cutsky(fn, **kwargs)
-            dist = distance(z)
-            randoms_positions = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
-        recon.assign_randoms(randoms_positions, randoms_weights)
+            import psutil
+            cache_memory = max_cache_fraction * psutil.virtual_memory().available / nodesize
+
+    def load_randoms(fn, ibuffer=0):
+        nonlocal cache_memory
+        rlog.info('Loading %s.', fn)
+        positions, weights, mask = get_positions_weights(fn, ibuffer=ibuffer)
+        catalog = None
+        if keep_randoms and cache_memory > 0:
+            nbytes = np.count_nonzero(mask) * get_catalog_dtype(fn).itemsize
+            if nbytes <= cache_memory:
+                catalog = read_catalog(fn, mask)
+                cache_memory -= nbytes
+            else:
+                rlog.info('Not enough memory left to cache %s, it will be read again.', fn)
+        return positions, weights, mask, catalog
+
+    def start_randoms(i, pool, loading):
+        # root collects file i read in the background and starts reading file i + 1; all ranks start scattering file i
+        positions, weights = None, None
+        if root:
+            positions, weights, mask, catalog = loading.pop(i).result()
+            if catalog is not None: catalogs[randoms_fn[i]] = catalog
+            elif keep_randoms: masks[randoms_fn[i]] = mask
+            if i + 1 < len(randoms_fn): loading[i + 1] = pool.submit(load_randoms, randoms_fn[i + 1], (i + 1) % nbuffers)
+        positions, request_positions = scatter_array(positions, mpicomm)
+        weights, request_weights = scatter_array(weights, mpicomm)
+        return positions, weights, [request_positions, request_weights]
+
+    # while file i is assigned, file i + 1 is being scattered and root reads file i + 2 in the background,
+    # in the buffer file i was sent from (assign_randoms only uses the scattered copy)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        loading = {0: pool.submit(load_randoms, randoms_fn[0], 0)} if root else {}
+        pending = start_randoms(0, pool, loading)
+        for i, fn in enumerate(randoms_fn):
+            randoms_positions, randoms_weights, requests = pending
+            wait_all(requests)
+            if i + 1 < len(randoms_fn): pending = start_randoms(i + 1, pool, loading)
+            recon.assign_randoms(randoms_positions, randoms_weights)
+            if keep_randoms: randoms_positions_by_fn[fn] = randoms_positions
+    # root buffers are not needed anymore: free them before the meshes are allocated
+    buffers = None
 
     recon.set_density_contrast(smoothing_radius=smoothing_radius)
     recon.run()
+    if wisdom_fn is not None:
+        save_fftw_wisdom(wisdom_fn)
 
     field = 'rsd' if convention == 'rsd' else 'disp+rsd'
     if type(recon) is IterativeFFTParticleReconstruction:
         data_positions_rec = recon.read_shifted_positions('data', field=field)
     else:
         data_positions_rec = recon.read_shifted_positions(data_positions, field=field)
+    data_positions_rec = gather_array(data_positions_rec, mpicomm)
 
-    distance_to_redshift = utils.DistanceToRedshift(distance)
     if root:
-        catalog = Table(data)
-        dist, ra, dec = utils.cartesian_to_sky(data_positions_rec)
-        catalog['RA'], catalog['DEC'], catalog['Z'] = ra, dec, distance_to_redshift(dist)
-        logger.info('Saving {}.'.format(data_rec_fn))
-        utils.mkdir(os.path.dirname(data_rec_fn))
-        catalog.write(data_rec_fn, format='fits', overwrite=True)
+        data['RA'], data['DEC'], data['Z'] = cartesian_to_sky(data_positions_rec, distance_table)
+        rlog.info('Saving %s.', data_rec_fn)
+        write_catalog(data_rec_fn, data)
 
     if convention != 'rsd':
         field = 'disp+rsd' if convention == 'recsym' else 'disp'
         for fn, rec_fn in zip(randoms_fn, randoms_rec_fn):
+            randoms_positions_rec = recon.read_shifted_positions(randoms_positions_by_fn.pop(fn), field=field)
+            randoms_positions_rec = gather_array(randoms_positions_rec, mpicomm)
             if root:
-                catalog = Table.read(fn)
-                (ra, dec, z), randoms_weights, mask = read_positions_weights_cutsky(fn, return_mask=True, **kwargs)
-                catalog = catalog[mask]
-                dist = distance(z)
-                randoms_positions = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
-            randoms_positions_rec = recon.read_shifted_positions(randoms_positions, field=field)
-            if root:
-                dist, ra, dec = utils.cartesian_to_sky(randoms_positions_rec)
-                catalog['RA'], catalog['DEC'], catalog['Z'] = ra, dec, distance_to_redshift(dist)
-                logger.info('Saving {}.'.format(rec_fn))
-                utils.mkdir(os.path.dirname(rec_fn))
-                catalog.write(rec_fn, format='fits', overwrite=True)
+                catalog = catalogs.pop(fn) if fn in catalogs else read_catalog(fn, masks.pop(fn))
+                catalog['RA'], catalog['DEC'], catalog['Z'] = cartesian_to_sky(randoms_positions_rec, distance_table)
+                rlog.info('Saving %s.', rec_fn)
+                write_catalog(rec_fn, catalog)
         
         
+_BIAS = {'ELG': 1.2, 'QSO': 2.07, 'LRG': 1.99, 'BGS': 1.5}
+
 def get_bias(tracer='ELG'):
     """Get the default tracer bias for a given target sample."""
-    if tracer.startswith('ELG'):
-        return 1.2
-    if tracer.startswith('QSO'):
-        return 2.07
-    if tracer.startswith('LRG'):
-        return 1.99
-    if tracer.startswith('BGS'):
-        return 1.5
-    return 1.2
+    return next((bias for prefix, bias in _BIAS.items() if tracer.startswith(prefix)), 1.2)
 
 
 
@@ -124,14 +239,20 @@ if __name__ == '__main__':
     parser.add_argument('--smoothing_radius', help='smoothing radius', type=float, default=15)
     parser.add_argument('--abs_maglim', help='absolute magnitude limit', type=float, default=None)
     parser.add_argument('--app_maglim', help='apparent magnitude limit', type=float, default=None)
+    parser.add_argument('--dtype', help='floating point precision of positions and meshes', type=str, choices=['f4', 'f8'], default='f4')
+    parser.add_argument('--wisdom_dir', help='where to save FFTW wisdom, not used in case pyrecon/mpi is used', type=str, default=os.environ.get('SCRATCH', None))
+    parser.add_argument('--region_parallel', help='reconstruct regions simultaneously, each on a subset of the MPI ranks', action='store_true')
+    parser.add_argument('--compress', help='write reconstructed catalogs as gzip-compressed .fits.gz files; cfitsio decompresses a whole file in memory when reading it, so reads (even of a few columns) are slower and use more memory', action='store_true')
+    parser.add_argument('--cache_memory', help='memory (in GiB) root may use to keep random catalogs in memory until reconstructed randoms are saved, instead of reading them again; 0 to disable; defaults to a quarter of the available memory of the node, divided by the number of ranks on the node', type=float, default=None)
 
     args = parser.parse_args()
 
+    from cosmoprimo.fiducial import DESI
+
     try:
         mpicomm = mpi.COMM_WORLD  # MPI version
     except AttributeError:
         mpicomm = None  # non-MPI version
-    root = mpicomm is None or mpicomm.rank == 0
     setup_logging()
 
     Reconstruction = {
@@ -142,8 +263,9 @@ if __name__ == '__main__':
 
     cat_dir = args.indir
     out_dir = args.outdir
-    if root: logger.info('Input directory is {}.'.format(cat_dir))
-    if root: logger.info('Output directory is {}.'.format(out_dir))
+    rlog = RootLoggerAdapter(logger, mpicomm)
+    rlog.info('Input directory is %s.', cat_dir)
+    rlog.info('Output directory is %s.', out_dir)
 
     if args.bias is not None:
         bias = args.bias
@@ -151,6 +273,13 @@ if __name__ == '__main__':
         bias = get_bias(args.tracer)
 
     regions = args.region
+    region_mpicomm = mpicomm
+    if args.region_parallel and mpicomm is not None and 1 < len(regions) <= mpicomm.size:
+        # regions are independent: split ranks between them rather than running them in turn
+        color = mpicomm.rank % len(regions)
+        region_mpicomm = mpicomm.Split(color, mpicomm.rank)
+        regions = [regions[color]]
+    region_rlog = RootLoggerAdapter(logger, region_mpicomm)
 
     zbox = get_z_cubicbox(args.tracer)
     if args.zlim is not None:
@@ -159,7 +288,13 @@ if __name__ == '__main__':
         zlims = get_z_cutsky(args.tracer)
     zlims = [(zlims[0], zlims[-1])]
 
-    distance = DESI().comoving_radial_distance 
+    # tabulate distance(z) once; a spline of the table is much cheaper than cosmoprimo on large arrays,
+    # and the table is also used to convert reconstructed distances back to redshifts
+    distance_table = tabulate_distance(DESI().comoving_radial_distance, zmax=zlims[-1][1] + 0.1, nz=8192)
+    distance = CubicSpline(*distance_table)
+
+    data_fn = catalog_fn(tracer=args.tracer, mock_type='cutsky')
+    randoms_fn = catalog_fn(tracer=args.tracer, mock_type='cutsky', name='randoms', nrandoms=args.nran)
 
     for zmin, zmax in zlims:
         if args.f is not None:
@@ -167,18 +302,17 @@ if __name__ == '__main__':
         else:
             f = get_f_reconstruction(zbox=zbox, zlim=(zmin, zmax), mock_type='cutsky')
         for region in regions:
-            if root:
-                logger.info(f'Running reconstruction in region {region} in redshift range {(zmin, zmax)} with f, bias = {(f, bias)}')
-            data_fn = catalog_fn(tracer=args.tracer, mock_type='cutsky')
-            randoms_fn = catalog_fn(tracer=args.tracer, mock_type='cutsky', name='randoms', nrandoms=args.nran)
+            region_rlog.info('Running reconstruction in region %s in redshift range %s with f, bias = %s',
+                             region, (zmin, zmax), (f, bias))
             data_rec_fn = catalog_fn(tracer=args.tracer, cat_dir=args.outdir, rec_type=args.algorithm+args.convention,
-                                     name='data', region=region, nrandoms=args.nran)
+                                     name='data', region=region, nrandoms=args.nran, compress=args.compress)
             randoms_rec_fn = catalog_fn(tracer=args.tracer, cat_dir=args.outdir, rec_type=args.algorithm+args.convention,
-                                        name='randoms', region=region, nrandoms=args.nran)
-            run_reconstruction(Reconstruction, distance, data_fn, randoms_fn,
+                                        name='randoms', region=region, nrandoms=args.nran, compress=args.compress)
+            run_reconstruction(Reconstruction, distance, distance_table, data_fn, randoms_fn,
                                f=f, bias=bias, boxsize=args.boxsize, nmesh=args.nmesh,
                                cellsize=args.cellsize, smoothing_radius=args.smoothing_radius,
-                               nthreads=args.nthreads, convention=args.convention, dtype='f8',
-                               mpicomm=mpicomm, zlim=(zmin, zmax), region=region, weight_type=args.weight_type,
+                               nthreads=args.nthreads, convention=args.convention, dtype=args.dtype,
+                               cache_memory=None if args.cache_memory is None else args.cache_memory * 2**30, wisdom_dir=args.wisdom_dir,
+                               mpicomm=region_mpicomm, zlim=(zmin, zmax), region=region, weight_type=args.weight_type,
                                abs_maglim=args.abs_maglim, app_maglim=args.app_maglim,
                                data_rec_fn=data_rec_fn, randoms_rec_fn=randoms_rec_fn,)
\ No newline at end of file